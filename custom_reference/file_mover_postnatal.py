@@ -1,12 +1,29 @@
 import argparse
+import csv
+import ctypes
 import os
 import sys
-import shutil
+import re
 import datetime
-from pathlib import Path
+from collections import Counter, namedtuple
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from logger import Logger
-import tkinter as tk
-from tkinter import font, messagebox
+
+# Number of CEL files copied concurrently. Copies are bound by network latency rather than CPU
+COPY_WORKERS = 8
+# Number of directories listed concurrently within each CEL origin folder. Listings are bound by network latency
+SCAN_WORKERS = 4
+# Buffer size used when copying CEL files. Larger reads mean fewer round trips per file over SMB
+COPY_BUFFER_SIZE = 4 * 1024 * 1024
+# CEL files may have an upper or lower case extension
+CEL_SUFFIXES = (".CEL", ".cel")
+# Folders that never contain CEL files, so are not searched. Hidden folders (starting with ".") are also skipped
+PRUNED_FOLDERS = {"$RECYCLE.BIN", "System Volume Information"}
+
+# CEL file names start with the specimen number and run number, separated by underscores
+CEL_FILE_NAME_PATTERN = re.compile(r"(?P<spec_no>[^_]+)_(?P<run_no>[^_]*)")
+# Record of a CEL file to copy. A namedtuple stores the fields without a dictionary per file
+CELCopy = namedtuple("CELCopy", ["src", "dest", "spec_no", "run_no"])
 
 
 def arg_parse():
@@ -43,6 +60,14 @@ def arg_parse():
         required=False,
         default=None,
     )
+    parser.add_argument(
+        "--location",
+        "-l",
+        choices=["VM", "S Drive"],
+        help="Where the script is being run from. If not provided, a message box is displayed to select this",
+        required=False,
+        default=None,
+    )
     return vars(parser.parse_args())
 
 
@@ -57,6 +82,111 @@ def validate_path(path: str) -> str:
         raise argparse.ArgumentTypeError(f"{path} is not a valid path")
 
 
+def file_signature(stat_result: os.stat_result) -> tuple:
+    """
+    Return the size and modification time (in whole seconds) of a file, used to determine whether a copy of a file
+    is the same as the original without reading either file
+        :param stat_result (os.stat_result):    Result of os.stat for the file
+        :return (tuple):                        Size and modification time of the file
+    """
+    return stat_result.st_size, int(stat_result.st_mtime)
+
+
+def list_folder(folder: str) -> tuple:
+    """
+    List a single folder, returning the subfolders to search and the CEL files it contains. os.scandir returns the
+    file type with the directory listing, so unlike Path.rglob no extra stat call is made per entry (each of which is
+    a network round trip on the S drive). Hidden folders and folders in PRUNED_FOLDERS are not returned. A folder
+    which cannot be read is logged as a warning and treated as empty
+        :param folder (str):        Folder to list
+        :return subfolders (list):  Paths of subfolders to search
+        :return cel_files (list):   Paths of CEL files in the folder
+    """
+    subfolders = []
+    cel_files = []
+    try:
+        with os.scandir(folder) as entries:
+            for entry in entries:
+                if entry.is_dir(follow_symlinks=False):
+                    if entry.name not in PRUNED_FOLDERS and not entry.name.startswith("."):
+                        subfolders.append(entry.path)
+                elif entry.name.endswith(CEL_SUFFIXES):
+                    cel_files.append(entry.path)
+    except OSError as exception:
+        logger.warning(f"Unable to search folder {folder} for CEL files: {exception}")
+    return subfolders, cel_files
+
+
+def scan_cel_files(folder: str):
+    """
+    Recursively yield the paths of all CEL files within the folder tree. The tree is searched one level at a time,
+    listing up to SCAN_WORKERS folders of each level concurrently so that the network round trips overlap
+        :param folder (str):    Folder to search
+        :return (generator):    Generator of CEL file paths (str)
+    """
+    folders = [folder]
+    with ThreadPoolExecutor(max_workers=SCAN_WORKERS) as executor:
+        while folders:
+            next_folders = []
+            for subfolders, cel_files in executor.map(list_folder, folders):
+                next_folders.extend(subfolders)
+                yield from cel_files
+            folders = next_folders
+
+
+def copy_with_copyfilew(src: str, dest: str) -> None:
+    """
+    Copy file from source to destination using the Windows CopyFileW function, which allows the file server to copy
+    the file itself rather than every byte passing through this machine
+        :param src (str):   Path of file to copy
+        :param dest (str):  Path to copy file to
+    """
+    if not ctypes.windll.kernel32.CopyFileW(str(src), str(dest), False):
+        raise ctypes.WinError()
+
+
+def copy_with_sendfile(src: str, dest: str) -> None:
+    """
+    Copy file contents from source to destination using os.sendfile, which copies within the kernel (Linux only)
+        :param src (str):   Path of file to copy
+        :param dest (str):  Path to copy file to
+    """
+    with open(src, "rb") as src_file, open(dest, "wb") as dest_file:
+        size = os.fstat(src_file.fileno()).st_size
+        offset = 0
+        while offset < size:
+            sent = os.sendfile(dest_file.fileno(), src_file.fileno(), offset, size - offset)
+            if sent == 0:
+                break
+            offset += sent
+
+
+def copy_with_buffer(src: str, dest: str) -> None:
+    """
+    Copy file contents from source to destination by reading into a single preallocated COPY_BUFFER_SIZE buffer,
+    which reduces the number of read and write calls per file compared to the shutil.copyfile default and avoids
+    allocating a new bytes object for each read
+        :param src (str):   Path of file to copy
+        :param dest (str):  Path to copy file to
+    """
+    with open(src, "rb") as src_file, open(dest, "wb") as dest_file:
+        buffer = bytearray(COPY_BUFFER_SIZE)
+        view = memoryview(buffer)
+        read = src_file.readinto(buffer)
+        while read:
+            dest_file.write(view[:read])
+            read = src_file.readinto(buffer)
+
+
+# Function used to copy CEL files, chosen once for the platform the script is running on
+if os.name == "nt":
+    fast_copy = copy_with_copyfilew
+elif sys.platform.startswith("linux"):
+    fast_copy = copy_with_sendfile
+else:
+    fast_copy = copy_with_buffer
+
+
 class CELMover:
     """
     Collates CEL files for a list of spec numbers to create a custom reference file
@@ -71,7 +201,8 @@ class CELMover:
         spec_col_name (str):                        Specimen number column header
         sex_col_name (str):                         Sex column header
         sex_subdirs (dict):                         Name of subdirectories to place CEL files in
-        files_to_copy_dict (dict):                  Dictionary of files to copy into the custom reference
+        files_to_copy_dict (dict):                  Dictionary of CEL file names and the CELCopy record of each file
+                                                    to copy into the custom reference
         specimen_number_dict (dict):			    Dictionary of spec nos containing their sex and sex subdir for the
                                                     file to be saved in, with specimen numbers in the
                                                     exclude_spec_numbers_file filtered out
@@ -87,28 +218,30 @@ class CELMover:
             to save the CEL file to. These strings are obtained from the file using the header to extract
             data from the correct columns (spec number = "Specimen ID", sex = "Result Type". If the sex column
             cannot be determined, sex entry is defined as "None"
-        get_csv_lines(file)
-            Extract lines from CSV file and return as list of strings
-        get_column_index(col_name)
-            Return column index for input column name
+        get_csv_rows(file)
+            Read CSV file and return its rows as a list of dictionaries keyed by column header
         filter_specimen_numbers(specimen_number_dict)
             Takes the specimen number dict and removes spec numbers specified in the exclude_spec_numbers_file
         find_cel_files()
             Searches (recursively) through hardcoded folders (self.cel_origin_folders) to identify all CEL files and
-            return these as a list
+            return these as a list, keeping only the first file with each name
         add_cel_files_to_dict()
             Identify CEL files that match a spec number in the self.specimen_number_dict and call
-            self.add_file_to_dict() to add the CEL file to the dictionary. If file is not a duplicate of a file that
-            has already been added to sthe dictionary, add file to dictionary
-        add_file_to_dict(spec_no, cel_file, file_name)
+            self.add_file_to_dict() to add the CEL file to the dictionary
+        add_file_to_dict(spec_no, run_no, cel_file, file_name)
             Add file to dictionary of files to copy
         remove_spec_nos_in_multiple_runs()
             Remove CEL files from the dictionary that are for specimen numbers that appear in multiple runs
         create_output_subdirs()
-            Checks if output subdirectories exist and if not create them
+            Create output subdirectories if they do not already exist
+        get_existing_files()
+            Return the paths, sizes and modification times of all files already present in the output subdirectories
         copy_files()
-            If CEL file does not already exist in the destination directory,
-            copy the file from source to destination
+            Copy all CEL files in the dictionary of files to copy that do not already exist in the destination
+            directory with the same size and modification time, using a pool of COPY_WORKERS threads
+        copy_file(cel_copy, existing_signature)
+            Copy the CEL file to a temporary file beside the destination, then move it into place, unless the
+            destination already exists with the same size and modification time as the source
     """
 
     def __init__(
@@ -177,12 +310,10 @@ class CELMover:
                                                     sex subdir for the file to be saved in
         """
         specimen_number_dict = {}
-        file_lines = self.get_csv_lines(self.spec_number_file)
-        for line in file_lines[
-            1:
-        ]:  # Extract the spec number from rest of the lines in file
-            spec_no = line.split(",")[self.get_column_index(self.spec_col_name)]
-            sex = line.split(",")[self.get_column_index(self.sex_col_name)]
+        for row in self.get_csv_rows(self.spec_number_file):
+            # Interned so that the specimen numbers stored for each CEL file share the dictionary key strings
+            spec_no = sys.intern(row[self.spec_col_name].strip())
+            sex = row.get(self.sex_col_name) or ""
             for subdir in self.sex_subdirs.keys():
                 if subdir in sex:
                     specimen_number_dict[spec_no] = {
@@ -194,60 +325,42 @@ class CELMover:
         )  # Summarise number of specimens
         return specimen_number_dict
 
-    def get_csv_lines(self, file: str) -> list:
+    def get_csv_rows(self, file: str) -> list:
         """
-        Extract lines from CSV file and return as list of strings
+        Read CSV file and return its rows as a list of dictionaries keyed by column header. The file is
+        read once, and unlike splitting lines on "," quoted fields containing commas are parsed correctly
             :param file (str):          Path to file
-            :return file_list (list):   List of strings, one per line of the file
+            :return rows (list):        List of dictionaries, one per row of the file after the header
         """
-        with open(file, "r") as input_file:
-            file_list = input_file.readlines()
-        return file_list
+        with open(file, "r", newline="") as input_file:
+            rows = list(csv.DictReader(input_file))
+        return rows
 
-    def get_column_index(self, col_name: str):
-        """
-        Return column index for input column name
-            :param col_name (str):      Column name string
-            :return col_index (int):    Index of column
-        """
-        file_lines = self.get_csv_lines(self.spec_number_file)
-        for count, header in enumerate(file_lines[0].split(",")):
-            if header.rstrip() == col_name:
-                col_index = count
-        return col_index
-
-    def filter_specimen_numbers(self, specimen_number_dict: dict):
+    def filter_specimen_numbers(self, specimen_number_dict: dict) -> dict:
         """
         Takes the specimen number dict and removes spec numbers specified in the exclude_spec_numbers_file
             :param specimen_number_dict (dict):	            Dictionary of spec nos containing their sex and
-                                                            sex subdir for the file to be saved inmber_dict
+                                                            sex subdir for the file to be saved in
             :return filtered_specimen_number_dict (dict):   specimen_number_dict with specimens marked for
                                                             exclusion removed
         """
-        to_exclude_list = []
-        excluded = 0
-        filtered_specimen_number_dict = specimen_number_dict.copy()
-        file_lines = self.get_csv_lines(self.exclude_spec_numbers_file)
-        spec_col_index = self.get_column_index(self.spec_col_name)
-
-        # Extract the specimen number from the rest of the lines in file
-        for line in file_lines[1:]:
-            to_exclude_list.append((line.split(",")[spec_col_index]))
-
-        to_exclude_list = list(set(to_exclude_list))
-        logger.info(f"{len(to_exclude_list)} specimen numbers in exclusion file")
+        # Extract the specimen number from the rows of the file
+        to_exclude = {
+            row[self.spec_col_name].strip()
+            for row in self.get_csv_rows(self.exclude_spec_numbers_file)
+        }
+        logger.info(f"{len(to_exclude)} specimen numbers in exclusion file")
 
-        for spec_no in specimen_number_dict.keys():
-            if spec_no in to_exclude_list:
-                del filtered_specimen_number_dict[spec_no]
-                excluded += 1
+        filtered_specimen_number_dict = {
+            spec_no: spec_no_dict
+            for spec_no, spec_no_dict in specimen_number_dict.items()
+            if spec_no not in to_exclude
+        }
+        excluded = len(specimen_number_dict) - len(filtered_specimen_number_dict)
 
         logger.info(
             f"{excluded} specimen numbers from the input specimen numbers file excluded"
         )
-        assert excluded + len(filtered_specimen_number_dict.keys()) == len(
-            specimen_number_dict
-        )
         # Summarise number of specimens
         logger.info(
             f"{len(filtered_specimen_number_dict)} spec numbers from the input specimen "
@@ -258,7 +371,8 @@ class CELMover:
     def find_cel_files(self) -> list:
         """
         Searches (recursively) through hardcoded folders (self.cel_origin_folders) to identify all CEL files and
-        return these as a list
+        return these as a list. Folders are searched concurrently, as the search is bound by network latency.
+        CEL files with the same name as a file already found are likely duplicates, so are discounted
             :return cel_files (list):   List of all CEL files in supplied folder locations and their subdirectories
         """
         cel_files = []
@@ -266,93 +380,96 @@ class CELMover:
         for folder in self.cel_origin_folders:
             if os.path.exists(folder):
                 logger.info(f"The input directory exists: {folder}")
-                folder_cel_files = list(Path(folder).rglob("*.CEL"))
-                logger.info(
-                    f"Identified {len(folder_cel_files)} CEL files in input folder: {folder}"
-                )
-                cel_files.extend(
-                    folder_cel_files
-                )  # Extract paths of all CEL files in each folder
                 validated_folders.append(folder)
             else:
                 logger.warning(
                     f"The input directory does not exist, skipping: {folder}"
                 )
+        if validated_folders:
+            with ThreadPoolExecutor(max_workers=len(validated_folders)) as executor:
+                searched_cel_files = executor.map(
+                    lambda folder: list(scan_cel_files(folder)), validated_folders
+                )
+                for folder, folder_cel_files in zip(validated_folders, searched_cel_files):
+                    logger.info(
+                        f"Identified {len(folder_cel_files)} CEL files in input folder: {folder}"
+                    )
+                    cel_files.extend(folder_cel_files)  # Extract paths of all CEL files in each folder
         self.cel_origin_folders = validated_folders
         logger.info(f"{len(cel_files)} total CEL files identified in input folders")
-        return cel_files
+        # The input folders can hold copies of the same CEL file, so only the first file with each name is kept
+        unique_cel_files = {}
+        for cel_file in cel_files:
+            unique_cel_files.setdefault(os.path.basename(cel_file), cel_file)
+        logger.info(
+            f"{len(cel_files) - len(unique_cel_files)} files were discounted as they were determined to be likely "
+            "duplicates"
+        )
+        return list(unique_cel_files.values())
 
-    def add_cel_files_to_dict(self) -> None:  # Docstring done
+    def add_cel_files_to_dict(self) -> None:
         """
         Identify CEL files that match a spec number in the self.specimen_number_dict and call self.add_file_to_dict()
-        to add the CEL file to the dictionary. If file is not a duplicate of a file that has already been added to
-        the dictionary, add file to dictionary
+        to add the CEL file to the dictionary. Duplicate files have already been removed by self.find_cel_files().
+        CEL file names start with the specimen number and run number, which are extracted with
+        CEL_FILE_NAME_PATTERN, so each file name is matched with a single dictionary lookup rather than by searching
+        the path for every specimen number
         """
         logger.info(
             f"Identifying CEL files that contain specimen numbers in the filtered specimen number list"
         )
         match_no_spec_nos = 0
-        duplicate_file_count = 0
-        spec_nos = list(self.specimen_number_dict.copy().keys())
         for cel_file in self.cel_files:
-            cel_file_str = cel_file.__str__()
-            if any(spec_no in cel_file_str for spec_no in spec_nos):
-                for spec_no in spec_nos:
-                    file_name = cel_file_str.split("\\")[-1]
-                    if spec_no in cel_file_str:
-                        if file_name in self.files_to_copy_dict:
-                            duplicate_file_count += 1
-                        else:  # File is not a duplicate, so add to the dict
-                            self.add_file_to_dict(spec_no, cel_file, file_name)
+            file_name = os.path.basename(cel_file)
+            match = CEL_FILE_NAME_PATTERN.match(file_name)
+            if match and match.group("spec_no") in self.specimen_number_dict:
+                self.add_file_to_dict(
+                    sys.intern(match.group("spec_no")), match.group("run_no"), cel_file, file_name
+                )
             else:
                 match_no_spec_nos += 1
-        logger.info(
-            f"{duplicate_file_count} files were discounted as they were determined to be likely duplicates"
-        )
         logger.info(
             f"{match_no_spec_nos} files were discounted as they do not match input specimen numbers in the "
             "filtered specimen number list"
         )
-        logger.info(  # TODO update this with the correct way of counting this!
+        logger.info(
             f"{len(self.files_to_copy_dict)} CEL files identified for copying that match specimen numbers in "
             "the filtered specimen number list"
         )
 
-    def add_file_to_dict(self, spec_no: str, cel_file: Path, file_name: str) -> None:
+    def add_file_to_dict(self, spec_no: str, run_no: str, cel_file: str, file_name: str) -> None:
         """
         Add file to dictionary of files to copy
             :param spec_no (str):			Specimen number for the CEL file
-            :param cel_file (Path):         Specimen number for the CEL file
+            :param run_no (str):            Run number for the CEL file
+            :param cel_file (str):          Path of the CEL file
             :param file_name (str):         Name of CEL file
         """
-        cel_file_str = cel_file.__str__()
-        self.files_to_copy_dict[file_name] = {
-            "src": cel_file,
-            "dest": os.path.join(
-                self.specimen_number_dict[spec_no]["sex_subdir"],
-                cel_file.__str__().split("\\")[-1],
+        self.files_to_copy_dict[file_name] = CELCopy(
+            src=cel_file,
+            dest=os.path.join(
+                self.specimen_number_dict[spec_no]["sex_subdir"], file_name
             ),
-            "spec_no": (cel_file_str.split("\\")[-1]).split("_")[0],
-            "run_no": (cel_file_str.split("\\")[-1]).split("_")[1],
-        }
+            spec_no=spec_no,
+            run_no=run_no,
+        )
 
     def remove_spec_nos_in_multiple_runs(self) -> None:
         """
         Remove CEL files from the dictionary that are for specimen numbers that appear in multiple runs
         """
-        spec_nos = list(self.specimen_number_dict.copy().keys())
-        cel_files_removed = 0
-        for spec_no in spec_nos:
-            duplicate_spec_no_files = [
-                file_name
-                for file_name in self.files_to_copy_dict.keys()
-                if self.files_to_copy_dict[file_name]["spec_no"] == spec_no
-            ]
-            if len(duplicate_spec_no_files) > 1:
-                # Remove CEL files from dictionary for this spec number as they are from multiple runs
-                for file_name in duplicate_spec_no_files:
-                    self.files_to_copy_dict.pop(file_name)
-                    cel_files_removed += 1
+        # Count CEL files per spec number in a single pass over the dictionary
+        spec_no_counts = Counter(
+            cel_copy.spec_no for cel_copy in self.files_to_copy_dict.values()
+        )
+        files_to_copy_count = len(self.files_to_copy_dict)
+        # Remove CEL files from dictionary for spec numbers with files from multiple runs
+        self.files_to_copy_dict = {
+            file_name: cel_copy
+            for file_name, cel_copy in self.files_to_copy_dict.items()
+            if spec_no_counts[cel_copy.spec_no] == 1
+        }
+        cel_files_removed = files_to_copy_count - len(self.files_to_copy_dict)
         logger.info(
             f"{cel_files_removed} CEL files removed as the specimen number was present in CEL files from multiple runs"
         )
@@ -360,35 +477,110 @@ class CELMover:
 
     def create_output_subdirs(self) -> None:
         """
-        Checks if output subdirectories exist and if not create them
+        Create output subdirectories if they do not already exist
         """
-        for dirtype, dirpath in self.sex_subdirs.items():
-            if not os.path.exists(dirpath):
-                os.mkdir(dirpath)
-                logger.info(f"Created directory: {dirpath}")
+        for dirpath in self.sex_subdirs.values():
+            os.makedirs(dirpath, exist_ok=True)
+            logger.info(f"Output subdirectory: {dirpath}")
+
+    def get_existing_files(self) -> dict:
+        """
+        Return the paths, sizes and modification times of all files already present in the output subdirectories.
+        Each subdirectory is listed once, rather than checking whether each destination file exists individually
+            :return existing_files (dict):  Dictionary of paths of files in the output subdirectories and their
+                                            file_signature()
+        """
+        existing_files = {}
+        for dirpath in set(self.sex_subdirs.values()):
+            with os.scandir(dirpath) as entries:
+                existing_files.update(
+                    (os.path.join(dirpath, entry.name), file_signature(entry.stat()))
+                    for entry in entries
+                    if entry.is_file()
+                )
+        return existing_files
 
     def copy_files(self) -> None:
         """
-        If CEL file does not already exist in the destination directory,
-        copy the file from source to destination
+        Copy all CEL files in the dictionary of files to copy that do not already exist in the destination
+        directory, using a pool of COPY_WORKERS threads. The copies are made across network shares so are bound
+        by latency, which the threads overlap. Existing files are only skipped if they have the same size and
+        modification time as the source file, so files left incomplete by an interrupted run are copied again.
+        A file that cannot be copied is logged as an error without stopping the remaining copies
         """
+        existing_files = self.get_existing_files()
         logger.info(
-            f"{len(self.files_to_copy_dict)} total CEL files to copy. Starting."
+            f"{len(self.files_to_copy_dict)} total CEL files to copy, skipping any already in the output directory. "
+            "Starting."
         )
-        for file_name in self.files_to_copy_dict:
-            if not os.path.isfile(self.files_to_copy_dict[file_name]["dest"]):
-                shutil.copyfile(  # Copy the file into the provided subfolder
-                    self.files_to_copy_dict[file_name]["src"],
-                    self.files_to_copy_dict[file_name]["dest"],
-                )
+        skipped_copies = 0
+        failed_copies = 0
+        if self.files_to_copy_dict:
+            # No more threads than files, so small reruns do not start idle threads
+            with ThreadPoolExecutor(
+                max_workers=min(COPY_WORKERS, len(self.files_to_copy_dict))
+            ) as executor:
+                copies = {
+                    executor.submit(
+                        self.copy_file, cel_copy, existing_files.get(cel_copy.dest)
+                    ): cel_copy
+                    for cel_copy in self.files_to_copy_dict.values()
+                }
+                for copy in as_completed(copies):
+                    try:
+                        if not copy.result():
+                            skipped_copies += 1
+                    except OSError as exception:
+                        failed_copies += 1
+                        logger.error(
+                            f"Error when copying CEL file {copies[copy].src}: {exception}"
+                        )
+        logger.info(
+            f"{skipped_copies} CEL files already exist in the output directory so were not copied"
+        )
+        if failed_copies:
+            logger.error(f"{failed_copies} CEL files could not be copied")
         logger.info(f"CEL file copying complete")
 
+    def copy_file(self, cel_copy: CELCopy, existing_signature: tuple) -> bool:
+        """
+        Copy the CEL file from source to destination, unless the destination already exists with the same size
+        and modification time as the source. The source is checked here rather than before the copies are
+        submitted, so that on reruns the checks are made concurrently. The file is copied to a temporary file,
+        given the modification time of the source so that subsequent runs can identify it as already copied, and
+        then moved into place. Replacing the destination rather than writing into it means an existing destination
+        file is never modified in place, and an interrupted copy never leaves a partial file at the destination
+            :param cel_copy (CELCopy):              Record containing the source and destination of the CEL file
+            :param existing_signature (tuple):      file_signature() of the existing destination file, or None if
+                                                    the destination does not exist
+            :return (bool):                         False if the existing destination file was kept, else True
+        """
+        src_stat = os.stat(cel_copy.src)
+        if existing_signature == file_signature(src_stat):
+            return False
+        temp_dest = f"{cel_copy.dest}.part"
+        try:
+            fast_copy(  # Copy the file into the provided subfolder
+                cel_copy.src, temp_dest
+            )
+            os.utime(temp_dest, (src_stat.st_atime, src_stat.st_mtime))
+            os.replace(temp_dest, cel_copy.dest)
+        except OSError:
+            if os.path.exists(temp_dest):
+                os.remove(temp_dest)
+            raise
+        return True
+
 
 class MessageBox:
     """
-    Class for creating a message box for user input
+    Class for creating a message box for user input. tkinter is only imported when a message box is
+    created, so it is not loaded when the location is provided on the command line
 
     Attributes
+        tk (module):            tkinter module
+        font (module):          tkinter.font module
+        messagebox (module):    tkinter.messagebox module
         root (tk.Tk):           Main tkinter window
         var (tk.StringVar):     Tkinter variable to store selected choice
         choice (str | None):    Variable to store selected choice
@@ -407,9 +599,15 @@ class MessageBox:
         """
         Constructor for the MessageBox class
         """
-        self.root = tk.Tk()  # Create the main tkinter window
+        import tkinter
+        from tkinter import font, messagebox
+
+        self.tk = tkinter
+        self.font = font
+        self.messagebox = messagebox
+        self.root = self.tk.Tk()  # Create the main tkinter window
         self.var = (
-            tk.StringVar()
+            self.tk.StringVar()
         )  # Create a tkinter variable to store the selected choice
         self.choice = None  # Variable to store selected choice
 
@@ -417,7 +615,8 @@ class MessageBox:
         """
         Configure the tkinter window
         """
-        helv = font.Font(family="Helvetica", size=20, weight=font.BOLD)
+        tk = self.tk
+        helv = self.font.Font(family="Helvetica", size=20, weight=self.font.BOLD)
         self.root.geometry("520x300")
         self.root.title(
             "Please select where you are running the script from"
@@ -454,7 +653,7 @@ class MessageBox:
         """
         self.choice = self.var.get()
         # You can save the choice as a variable or perform any other action here
-        messagebox.showinfo("Selection", f"Choice saved: {self.choice}")
+        self.messagebox.showinfo("Selection", f"Choice saved: {self.choice}")
         self.root.destroy()
         if self.choice:
             logger.info(f"Choice saved: {self.choice}")
@@ -471,16 +670,19 @@ if __name__ == "__main__":
     )
     logger = Logger(logfile_path).logger
     logger.info("Running file_mover_postnatal.py")
-    message_box = MessageBox()
-    message_box.setup_window()
+    location = parsed_args["location"]
+    if not location:
+        message_box = MessageBox()
+        message_box.setup_window()
+        location = message_box.choice
 
-    if message_box.choice == "S Drive":
+    if location == "S Drive":
         cel_origin_folders = [
             r"S:\Genetics_Data2\Array\Geneworks - Viapath Cloud sync folder\Archive\CEL and ARR files do not delete",
             r"S:\Genetics_Data2\Array\Geneworks - Viapath Cloud sync folder\UploadToCloud",
         ]
 
-    elif message_box.choice == "VM":
+    elif location == "VM":
         cel_origin_folders = [
             r"\\GRPVCHASDB01\Archive\CEL and ARR files do not delete",
             r"\\GRPVCHASDB01\Genetics\In",
@@ -1,4 +1,5 @@
 import argparse
+import csv
 import os
 import sys
 import shutil
@@ -6,6 +7,17 @@ import random
 import string
 import re
 from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+
+# folders searched (in order) for the CEL files of samples used to create the custom reference
+CEL_FOLDERS = [
+    r'S:\Genetics_Data2\Array\Geneworks - Viapath Cloud sync folder\Archive\CEL and ARR files do not delete',
+    r'S:\Genetics_Data2\Array\Geneworks - Viapath Cloud sync folder\UploadToCloud',
+]
+# CEL files may have an upper or lower case extension. str.endswith accepts a tuple so no per-file lowercasing is needed
+CEL_SUFFIXES = ('.CEL', '.cel')
+# number of files copied at once. Copies to and from the S drive are limited by network latency rather than bandwidth
+COPY_WORKERS = 8
 
 def get_args(args):
     parser = argparse.ArgumentParser()
@@ -19,11 +31,11 @@ def get_args(args):
 
 def check_for_output_dir(args):
     """
-    Checks if output folders exist and if not create them
+    Create output folders if they do not already exist
     """
     for folder in [args.output_folder,args.syndrome_free_files]:
-        if folder and not os.path.exists(folder):
-            os.path.mkdir(folder)
+        if folder:
+            os.makedirs(folder, exist_ok=True)
     
 
 def create_list_of_spec_numbers(args):
@@ -33,44 +45,103 @@ def create_list_of_spec_numbers(args):
     Returns a list of specimen numbers
     """
     spec_number_list=[]
-    with open(r'%s' % args.spec_numbers) as input_file:
-        file_list=input_file.readlines()
-        # get the column number containing the specimen number
-    for count,header in enumerate(file_list[0].split(",")):
-        if header=="Specimen ID":
-            spec_column=count
-    # extract the spec number from rest of the lines in file
-    for line in file_list[1:]:
-        spec_number_list.append(line.split(",")[spec_column])
+    # the csv module uses the header to find the column and handles quoted fields containing commas
+    with open(r'%s' % args.spec_numbers, newline="") as input_file:
+        # extract the spec number from rest of the lines in file
+        for row in csv.DictReader(input_file):
+            spec_number_list.append(row["Specimen ID"].strip())
     #summarise number of specimens
     print("%s in spec number list" % len(spec_number_list)) 
     return spec_number_list
 
+def compile_spec_number_pattern(spec_number_list, suffix):
+    """
+    Compile a single regular expression matching filenames which start with any of the given specimen numbers and end with the given suffix.
+    As for str.endswith the suffix can be a string or a tuple of strings.
+    Longer specimen numbers are tried first so the most specific specimen number is captured in group 1
+    """
+    if isinstance(suffix, str):
+        suffix = (suffix,)
+    alternation = "|".join(re.escape(spec_number) for spec_number in sorted(set(spec_number_list), key=len, reverse=True))
+    return re.compile(r'^(%s).*(?:%s)$' % (alternation, "|".join(re.escape(ending) for ending in suffix)))
+
+def match_spec_number(filename, spec_numbers, pattern):
+    """
+    Return the specimen number at the start of the filename, or None if it does not match.
+    Filenames are conventionally <specimen number>_..., so the leading token is first looked up in the set of specimen numbers,
+    falling back to the pattern (from compile_spec_number_pattern) for filenames which don't follow the convention
+    """
+    head = filename.split("_", 1)[0]
+    if head in spec_numbers:
+        return head
+    match = pattern.match(filename)
+    if match:
+        return match.group(1)
+    return None
+
+def scan_files(folder):
+    """
+    Recursively yield a DirEntry for every file within the folder tree.
+    os.scandir returns the file type with the directory listing, so unlike os.walk no extra stat call is made per entry
+    (each of which is a network round trip on the S drive). Folders which cannot be read are skipped, as with os.walk
+    """
+    try:
+        with os.scandir(folder) as entries:
+            for entry in entries:
+                if entry.is_dir(follow_symlinks=False):
+                    yield from scan_files(entry.path)
+                elif entry.is_file(follow_symlinks=False):
+                    yield entry
+    except OSError:
+        return
+
 def find_files(parsed_args,spec_number_list):
     """
-    Searches (recursively) through the provided input folder for a rhchp file for each speciment number in the list.
-    If found it will copy the file to the given output folder
-    """
-    for spec_number in spec_number_list:
-        found=False
-        for file in os.listdir(parsed_args.output_folder):
-            # files end with .rhchp and can be anywhere within a folder tree
-            if re.match(r'(%s).*(.rhchp$)' % (spec_number), file):
-                found = True
-        
-        # if multiple files per specimen id only the first will be taken.
-        while not found:
-            for root,dirs,files in os.walk(r'%s' % parsed_args.input_folder):
-                for file in files:
-                    # file ends with .rhchp to exclude some other file types
-                    if re.match(r'(%s).*(.rhchp$)' % (spec_number), file):
-                        if not os.path.isfile(os.path.join(parsed_args.output_folder,file)):
-                            # copy the file into the provided subfolder
-                            shutil.copyfile(os.path.join(root,file),os.path.join(parsed_args.output_folder,file))
-                        found=True
-            if not found:
-                print("Error when finding rhchp file - No file found for spec number %s" %(spec_number))
-                break
+    Searches (recursively) through the provided input folder for rhchp files for the specimen numbers in the list.
+    The input folder is walked once, testing each file against a single pattern covering all specimen numbers.
+    If found it will copy the file to the given output folder. Copies run in a thread pool as files are found so they overlap with the walk
+    """
+    if not spec_number_list:
+        return
+    found=set()
+    # specimen numbers with a rhchp file already in the output folder do not need to be searched for
+    pattern = compile_spec_number_pattern(spec_number_list, ".rhchp")
+    spec_numbers = set(spec_number_list)
+    for file in os.listdir(parsed_args.output_folder):
+        if file.endswith(".rhchp"):
+            spec_number = match_spec_number(file, spec_numbers, pattern)
+            if spec_number:
+                found.add(spec_number)
+    to_find = [spec_number for spec_number in spec_number_list if spec_number not in found]
+
+    if to_find:
+        pattern = compile_spec_number_pattern(to_find, ".rhchp")
+        spec_numbers = set(to_find)
+        copies = []
+        # destinations already submitted for copying. Copies run concurrently, so a file with the same name
+        # found later in the walk is not yet on disk and would otherwise be copied to the same destination
+        submitted = set()
+        with ThreadPoolExecutor(max_workers=COPY_WORKERS) as executor:
+            for entry in scan_files(parsed_args.input_folder):
+                # files end with .rhchp and can be anywhere within a folder tree. Checking the suffix first
+                # avoids running the pattern against the many other files in the tree
+                if not entry.name.endswith(".rhchp"):
+                    continue
+                spec_number = match_spec_number(entry.name, spec_numbers, pattern)
+                if spec_number:
+                    dest = os.path.join(parsed_args.output_folder,entry.name)
+                    if dest not in submitted and not os.path.isfile(dest):
+                        # copy the file into the provided subfolder
+                        submitted.add(dest)
+                        copies.append(executor.submit(shutil.copyfile,entry.path,dest))
+                    found.add(spec_number)
+        # raise any error from the copies
+        for copy in copies:
+            copy.result()
+
+    for spec_number in to_find:
+        if spec_number not in found:
+            print("Error when finding rhchp file - No file found for spec number %s" %(spec_number))
 
 def get_syndrome_regions(parsed_args):
     """
@@ -111,6 +182,7 @@ def copy_files_with_no_syndrome_overlaps(parsed_args,multi_sample_viewer_file,sy
     """
     skip=0
     not_skip=0
+    syndrome_free_samples=[]
     for sample in multi_sample_viewer_file:
         if not os.path.exists(os.path.join(parsed_args.output_folder,sample)):
             print("rhchp file for sample %s not present in folder %s" % (sample,parsed_args.output_folder))
@@ -127,38 +199,64 @@ def copy_files_with_no_syndrome_overlaps(parsed_args,multi_sample_viewer_file,sy
                             skip+=1
             if not sample_skip:
                 not_skip+=1
-                #create random string to anonymise
-                random_file_name = "".join(random.choices(string.ascii_letters + string.digits, k=8))
-                cel_file_path = find_cel_file(sample)
-                if cel_file_path:
-                    shutil.copyfile(cel_file_path,os.path.join(parsed_args.syndrome_free_files,"%s.CEL" % (random_file_name)))
-                else:
-                    print("CEL file not found for %s" % sample)
+                syndrome_free_samples.append(sample)
     #print("skipped = %s, not skipped =%s" % (skip,not_skip))
-    
-def find_cel_file(sample_test_number):
+
+    # find the CEL files for all syndrome free samples in a single pass of the CEL file folders
+    cel_file_paths = find_cel_files(syndrome_free_samples)
+    for sample in syndrome_free_samples:
+        if sample in cel_file_paths:
+            #create random string to anonymise
+            random_file_name = "".join(random.choices(string.ascii_letters + string.digits, k=8))
+            shutil.copyfile(cel_file_paths[sample],os.path.join(parsed_args.syndrome_free_files,"%s.CEL" % (random_file_name)))
+        else:
+            print("CEL file not found for %s" % sample)
+
+def find_cel_files(sample_test_numbers):
     """
-    Given a sample_test_number from the multisample viewer (eg 2128184_SNP_220302.1) find the associated cel file
+    Given a list of sample_test_numbers from the multisample viewer (eg 2128184_SNP_220302.1) find the associated cel files
+    Each CEL file folder is walked once, testing every file against a single pattern covering all samples.
+    The folders are walked concurrently as the walk is dominated by waiting on the network share.
     Note because the sample_test_number is used as opposed to spec number wouldn't expect duplicates.
-    return the cel file if found, else return None.
-    """
-    # if multiple files per specimen id only the first will be taken.
-    for root,dirs,files in os.walk(r'S:\Genetics_Data2\Array\Geneworks - Viapath Cloud sync folder\Archive\CEL and ARR files do not delete'):
-        for file in files:
-            #print(files)
-            # file ends with .CEL (case sensitive) to exclude some other file types
-            if re.match(r'(%s).*(.CEL$)' % (sample_test_number.replace(".rhchp","")), file):
-                return os.path.join(root,file)
-    
-    for root,dirs,files in os.walk(r'S:\Genetics_Data2\Array\Geneworks - Viapath Cloud sync folder\UploadToCloud'):
-        for file in files:
-            #print(files)
-            # file ends with .CEL (case sensitive) to exclude some other file types
-            if re.match(r'(%s).*(.CEL$)' % (sample_test_number.replace(".rhchp","")), file):
-                return os.path.join(root,file)
-    return None
-        
-    
+    return a dictionary of sample_test_number: cel file, containing only the samples where a cel file was found.
+    """
+    cel_file_paths = {}
+    # check each folder is reachable once, rather than waiting on a network timeout for every directory in it
+    cel_folders = []
+    for folder in CEL_FOLDERS:
+        if os.path.isdir(folder):
+            cel_folders.append(folder)
+        else:
+            print("CEL file folder %s is not accessible, skipping" % folder)
+    if not sample_test_numbers or not cel_folders:
+        return cel_file_paths
+    samples = {sample_test_number.replace(".rhchp",""): sample_test_number for sample_test_number in sample_test_numbers}
+    pattern = compile_spec_number_pattern(samples, CEL_SUFFIXES)
+    with ThreadPoolExecutor(max_workers=len(cel_folders)) as executor:
+        folder_matches = executor.map(lambda folder: find_cel_files_in_folder(folder, pattern), cel_folders)
+        # results are returned in the order of CEL_FOLDERS
+        for matches in folder_matches:
+            for sample, cel_file_path in matches:
+                # if multiple files per sample only the first will be taken, searching the archive first.
+                if samples[sample] not in cel_file_paths:
+                    cel_file_paths[samples[sample]] = cel_file_path
+    return cel_file_paths
+
+def find_cel_files_in_folder(folder, pattern):
+    """
+    Walk a single CEL file folder and return a list of (sample, cel file) tuples for files matching the pattern
+    """
+    matches = []
+    for entry in scan_files(folder):
+        # file ends with .CEL or .cel to exclude some other file types
+        if not entry.name.endswith(CEL_SUFFIXES):
+            continue
+        match = pattern.match(entry.name)
+        if match:
+            matches.append((match.group(1), entry.path))
+    return matches
+
+
 def main(args):
     parsed_args=get_args(args)
     check_for_output_dir(parsed_args)
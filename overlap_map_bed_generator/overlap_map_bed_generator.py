@@ -9,13 +9,34 @@ genes - this reduces the number of calls needing interpretation so speeds up the
 analysis and checking process.
 """
 from __future__ import annotations
-import os
-import subprocess
+import re
 from pathlib import Path
+import numpy as np
 import pandas as pd
 import duckdb
 
 
+def natural_sort_key(chromosomes: pd.Series) -> pd.Series:
+    """
+    Sort key for chromosome names which recognises that 10 comes after 2 (equivalent to
+    `sort -V`). Each name is split into runs of digits, compared numerically, and runs
+    of non-digits, compared alphabetically. Only the distinct names are compared, and
+    each name is then mapped to its rank
+        :param chromosomes (pd.Series): Chromosome names
+        :return (pd.Series):            Rank of each chromosome name
+    """
+    ranks = {
+        chromosome: rank for rank, chromosome in enumerate(sorted(
+            chromosomes.unique(),
+            key=lambda chromosome: tuple(
+                int(part) if part.isdigit() else part
+                for part in re.split(r"(\d+)", chromosome)
+            )
+        ))
+    }
+    return chromosomes.map(ranks).astype("int64")
+
+
 class GenerateBed():
     """
     This class contains the methods for creating the BED file containing coordinates of
@@ -32,46 +53,34 @@ class GenerateBed():
                                             non-coding. This is used to identify which
                                             probes require masking
         outdir (str):                       Directory path to output files to
-        grch38_fai_file (str):              Path to grch38 fasta index file
-        grch38_genome_file (str):           Path to Genome file for bedtools. Generated
-                                            from grch38_fai_file by
-                                            self.get_genome_file()
-        coding_regions_bed (str):           Path to BED file containing only coding
-                                            regions
-        coding_regions_bed_sorted (str):    Path to BED file containing single per-gene
-                                            regions
-        noncoding_regions_bed (str):        Path to BED file containing the non-coding
-                                            regions outside protein-coding genes
-        noncoding_probes (str):             Path to BED file containing only probes
-                                            within the noncoding regions
+        grch38_fai_file (str):              Path to grch38 fasta index file, used for
+                                            chromosome lengths
         probes_to_mask_bed (str):           Path to BED file containing final probes
                                             that require masking in the CHAS software
-        noncoding_regions_df
-        (pd.DataFrame):                     Pandas dataframe containing the non-coding
+        coding_regions_df (pd.DataFrame):   Pandas dataframe containing single per-gene
+                                            coding regions
+        noncoding_regions
+        (duckdb.DuckDBPyRelation):          DuckDB relation containing the non-coding
                                             regions outside protein-coding genes
-        noncoding_probes_df (pd.DataFrame): Pandas dataframe containing only probes
-                                            within the noncoding regions
+        probes_df (pd.DataFrame):           Pandas dataframe containing all probes from
+                                            the probes_bed file
         probes_to_mask_df (pd.DataFrame):   Pandas dataframe containing final probes
                                             that require masking in the CHAS software
 
     Methods
-        get_genome_file()
-            Run subprocess to generate .genome file from genome.fa.fai
-        get_coding_regions_bed()
-            Read the genes_aed file and manipulate to produce a BED file containing only
+        get_coding_regions()
+            Read the genes_aed file and manipulate to produce a dataframe containing only
             coding regions
         filter_to_coding_regions(regions_df)
             Filter genes_aed dataframe so that it contains only coding regions, and drop
             category and strand columns
         condense_regions(coding_regions_df)
             Condense regions that overlap into single per-gene regions
-        get_noncoding_regions_bed()
-            Run bedtools complement to find the regions in the genome file that are not
-            represented in the coding regions BED file (i.e. the non coding regions
-            outside protein coding genes)
-        get_noncoding_probes()
-            Generate dataframe that contains all probes within the noncoding regions in
-            the self.noncoding_regions_bed BED file
+        get_noncoding_regions()
+            Find the regions in the genome that are not represented in the coding
+            regions (i.e. the non coding regions outside protein coding genes)
+        get_probes()
+            Read all probes from the probes_bed file into a dataframe
         remove_probes()
             Remove any probes that are within self.num_probes distance of a coding
             region. Calls remove_probes_within_regions() and remove_probes_by_distance()
@@ -81,15 +90,14 @@ class GenerateBed():
             within these regions are < self.num_probes away from the nearest coding
             region
         remove_probes_by_distance(filtered_probes_within_regions)
-            Remove probes that are within self.num_probes of a coding region. Use range
-            (self.num_probes-1)-(self.num_probes-1) because index starts from 0. This
+            Remove probes that are within self.num_probes of a coding region. This
             retains only those probes greater than self.num_probes away from the
-            nearest coding region, i.e. those probes to be masked
+            nearest coding region, i.e. those probes to be masked, sorted by chromosome
+            and position
         match_probes_to_regions()
-            Split all probes into 'per-region' groups for the noncoding regions in
-            self.noncoding_regions_df
-        cleanup_intermediate_files()
-            Remove all intermediate BED files
+            Split all probes within the noncoding regions into 'per-region' groups for
+            the noncoding regions in self.noncoding_regions, numbering the probes by
+            position within each region
         write_to_final_csv()
             Write to final csv, with header
 
@@ -102,39 +110,20 @@ class GenerateBed():
         self.genes_aed = genes_aed
         self.outdir = outdir
         self.grch38_fai_file = f"{Path(__file__).parent.resolve()}/data/genome.fa.fai"
-        # Intermediate files
-        self.grch38_genome_file = f"{outdir}/grch38.genome"
-        self.coding_regions_bed = f"{outdir}/coding_regions_bed.bed"
-        self.coding_regions_bed_sorted = f"{outdir}/coding_regions_bed_sorted.bed"
-        self.noncoding_regions_bed = f"{outdir}/noncoding_regions_bed.bed"
-        self.noncoding_probes = f"{outdir}/non_coding_probes.bed"
         self.probes_to_mask_bed = f"{outdir}/probes_to_mask.bed"
         # Call methods
-        self.get_genome_file()
-        self.get_coding_regions_bed()
-        self.noncoding_regions_df = self.get_noncoding_regions_bed()
-        self.noncoding_probes_df = self.get_noncoding_probes()
+        self.coding_regions_df = self.get_coding_regions()
+        self.noncoding_regions = self.get_noncoding_regions()
+        self.probes_df = self.get_probes()
         self.probes_to_mask_df = self.remove_probes()
-        self.cleanup_intermediate_files()
         self.write_to_final_csv()
 
-    def get_genome_file(self) -> None:
-        """
-        Run subprocess to generate .genome file from genome.fa.fai. Extract column 1 and
-        2 from the genome.fa.fai file and write to .genome file
-            :return None:
-        """
-        genome_cmd = (
-            "awk -v OFS='\t' {'print $1,$2'} " +
-            f"{self.grch38_fai_file} > {self.grch38_genome_file}"
-        )
-        subprocess.run(genome_cmd, shell=True, check=True)
-
-    def get_coding_regions_bed(self) -> None:
+    def get_coding_regions(self) -> pd.DataFrame:
         """
-        Read the genes_aed file and manipulate to produce a BED file containing only
+        Read the genes_aed file and manipulate to produce a dataframe containing only
         coding regions
-            :return None:
+            :return coding_regions_df (pd.DataFrame):   Pandas dataframe containing
+                                                        single per-gene coding regions
         """
         headers = [
             "Chr",
@@ -152,33 +141,34 @@ class GenerateBed():
             "gnomad:pLI",
             "cdsMax",
         ]
-        # Dataframe containing both coding and non-coding regions
+        # Dataframe containing both coding and non-coding regions. Superfluous columns
+        # are not read in
         regions_df = pd.read_csv(
             self.genes_aed,
             sep="\t",
             skiprows=11,  # Don't read in lines 1-11
             names=headers,
+            usecols=["Chr", "Start", "Stop", "name", "strand", "category"],
+            dtype={
+                "Chr": str,
+                "Start": "int32",
+                "Stop": "int32",
+                "name": str,
+                "strand": str,
+                "category": str,
+            },
             index_col="name",
-        ).drop(  # Drop superfluous columns
-            columns=[
-                "spans",
-                "cdsMin",
-                "refseq:accessionNumber",
-                "gnomad:percentHI",
-                "refseq:geneName",
-                "gnomad:pLI",
-                "cdsMax",
-                "value",
-            ]
         )
         # If strand is negative reverse start and stop values
-        regions_df.loc[regions_df["strand"] == "-", ["Start", "Stop"]] = regions_df.loc[
-            regions_df["strand"] == "-", ["Stop", "Start"]
-        ].values
+        negative_strand = regions_df["strand"].to_numpy() == "-"
+        start = regions_df["Start"].to_numpy()
+        stop = regions_df["Stop"].to_numpy()
+        regions_df["Start"] = np.where(negative_strand, stop, start)
+        regions_df["Stop"] = np.where(negative_strand, start, stop)
         # Filter df to only coding regions
         coding_regions_df = self.filter_to_coding_regions(regions_df)
         # Condense coding regions to per-gene regions
-        self.condense_regions(coding_regions_df)
+        return self.condense_regions(coding_regions_df)
 
     def filter_to_coding_regions(self, regions_df: pd.DataFrame) -> pd.DataFrame:
         """
@@ -191,91 +181,116 @@ class GenerateBed():
                                                         genes_aed file
         """
         coding_regions_df = regions_df[  # Keep only refseq/coding regions
-            regions_df["category"].str.contains("refseq/coding")
+            regions_df["category"].str.contains("refseq/coding", regex=False)
         ].drop(
             columns=["category", "strand"]  # Drop unnecessary columns
-            # Order and drop duplicate rows
-            ).sort_values(by=['name']).drop_duplicates(inplace=False)
+            )
+        # Drop duplicate rows. The gene name (the index) is not compared, so where
+        # genes share identical coordinates only the alphabetically first gene keeps
+        # the row. That gene is found among the rows with shared coordinates, rather
+        # than by sorting all rows by name
+        keep = ~coding_regions_df.duplicated(
+            subset=["Chr", "Start", "Stop"], keep=False
+            ).to_numpy()
+        shared_df = coding_regions_df[~keep]
+        first_names = shared_df.index.to_series().groupby(
+            [shared_df["Chr"].to_numpy(), shared_df["Start"].to_numpy(),
+             shared_df["Stop"].to_numpy()],
+            sort=False,
+            ).transform("min")
+        keep[~keep] = shared_df.index == first_names.to_numpy()
+        coding_regions_df = coding_regions_df[keep].drop_duplicates(inplace=False)
         return coding_regions_df
 
-    def condense_regions(self, coding_regions_df: pd.DataFrame) -> None:
+    def condense_regions(self, coding_regions_df: pd.DataFrame) -> pd.DataFrame:
         """
-        Condense regions that overlap into single per-gene regions and write to BED file
+        Condense regions that overlap into single per-gene regions
             :param coding_regions_df (pd.DataFrame):    Pandas dataframe containing only
                                                         coding regions
+            :return genes_start_stop (pd.DataFrame):    Pandas dataframe containing
+                                                        single per-gene coding regions
         """
         # Group by gene name and Chr, and aggregate into a single per-gene region, as we
-        # want to find only regions at least x probes away from the nearest coding gene
+        # want to find only regions at least x probes away from the nearest coding gene.
+        # Group order doesn't matter, as the non-coding regions query orders by position
         genes_start_stop = coding_regions_df.groupby(
-            ["name", "Chr"], group_keys=False
-            ).agg({"Start": min, "Stop": max})
+            ["name", "Chr"], sort=False, group_keys=False
+            ).agg({"Start": "min", "Stop": "max"})
         # Drop gene name column and re-index
-        genes_start_stop.index = genes_start_stop.index.droplevel(0)
-
-        # Write to BED file and sort
-        genes_start_stop.to_csv(self.coding_regions_bed, sep="\t", header=False)
-        # `-k1,1V`: Sort chromosome column  alphabetically, recognising 10 comes after 2
-        # `-k2,2n`: Sort start field numerically - loci which start first in a
-        #           chromosome come first
-        # `-k3,3n`: Sort stop field numerically, loci which end first come first when
-        #           they have the same start position
-        subprocess.run(
-            f"sort -k1,1V -k2,2n -k3,3n {self.coding_regions_bed} > "
-            f"{self.coding_regions_bed_sorted}",
-            shell=True,
-            check=True,
-        )
+        genes_start_stop = genes_start_stop.reset_index(level="Chr", drop=False)
+        return genes_start_stop.reset_index(drop=True)
 
-    def get_noncoding_regions_bed(self) -> None:
+    def get_noncoding_regions(self) -> duckdb.DuckDBPyRelation:
         """
-        Run bedtools complement to find the regions in the genome file that are not
-        represented in the coding regions BED file (i.e. the non coding regions) outside
-        protein coding genes
-            :return noncoding_regions_df (pd.DataFrame):    Pandas dataframe containing
-                                                            the non-coding regions
-                                                            outside protein-coding genes
+        Find the regions in the genome that are not represented in the coding regions
+        (i.e. the non coding regions) outside protein coding genes. Each gap
+        starts at the furthest stop position of all preceding coding regions on the
+        chromosome, so overlapping coding regions are treated as one. The region from
+        the last coding region to the end of the chromosome is added using the
+        chromosome lengths in the fasta index file
+            :return noncoding_regions (duckdb.DuckDBPyRelation):    DuckDB relation
+                                                                    containing the
+                                                                    non-coding regions
+                                                                    outside
+                                                                    protein-coding genes
         """
-        intersect_command = (
-            f"bedtools complement -i {self.coding_regions_bed_sorted} -g "
-            f"{self.grch38_genome_file} > {self.noncoding_regions_bed}"
+        coding_regions_df = self.coding_regions_df
+        genome_df = pd.read_csv(
+            self.grch38_fai_file,
+            sep="\t",
+            usecols=[0, 1],
+            names=["Chr", "Length"],
+            dtype={"Chr": str, "Length": "int32"},
         )
-        subprocess.run(intersect_command, shell=True, check=True)
-        # Read in noncoding regions dataframe
-        noncoding_regions_df = pd.read_csv(
-            self.noncoding_regions_bed, sep="\t", names=["Chr", "Start", "Stop"]
+        # Register the dataframes as views, as the relation below is only evaluated as
+        # part of the query in match_probes_to_regions
+        duckdb.register("coding_regions_df", coding_regions_df)
+        duckdb.register("genome_df", genome_df)
+        noncoding_regions = duckdb.query(
+            "WITH coding AS (SELECT Chr, Start, Stop, COALESCE(MAX(Stop) OVER ("
+            "PARTITION BY Chr ORDER BY Start, Stop ROWS BETWEEN UNBOUNDED PRECEDING "
+            "AND 1 PRECEDING), 0) AS prev_stop FROM coding_regions_df WHERE Chr IN "
+            "(SELECT Chr FROM genome_df)) "
+            "SELECT Chr, prev_stop AS Start, Start AS Stop FROM coding "
+            "WHERE Start > prev_stop "
+            "UNION ALL "
+            "SELECT genome_df.Chr, COALESCE(MAX(coding.Stop), 0) AS Start, "
+            "genome_df.Length AS Stop FROM genome_df LEFT JOIN coding "
+            "ON genome_df.Chr = coding.Chr GROUP BY genome_df.Chr, genome_df.Length "
+            "HAVING COALESCE(MAX(coding.Stop), 0) < genome_df.Length"
         )
-        return noncoding_regions_df
+        return noncoding_regions
 
-    def get_noncoding_probes(self) -> pd.DataFrame:
+    def get_probes(self) -> pd.DataFrame:
         """
-        Generate dataframe that contains all probes within the noncoding regions in the
-        self.noncoding_regions_bed BED file
-            :return noncoding_probes_df (pd.DataFrame):     Pandas dataframe containing
-                                                            only probes within the
-                                                            noncoding regions
+        Read all probes from the probes_bed file into a dataframe, skipping any track,
+        browser or comment lines at the top of the file
+            :return probes_df (pd.DataFrame):   Pandas dataframe containing all probes
         """
-        intersect_cmd = (
-            f"bedtools intersect -a {self.probes_bed} -b {self.noncoding_regions_bed} "
-            f"> {self.noncoding_probes}"
-        )
-        subprocess.run(intersect_cmd, shell=True, check=True)
-
-        # Read in noncoding probes dataframe generated by intersect command
-        headers = ["Chr", "Pos", "Stop", "Probe"]
-        noncoding_probes_df = pd.read_csv(
-            self.noncoding_probes,
+        header_lines = 0
+        with open(self.probes_bed, encoding="utf-8") as probes_bed:
+            for line in probes_bed:
+                if not line.startswith(("track", "browser", "#")):
+                    break
+                header_lines += 1
+        probes_df = pd.read_csv(
+            self.probes_bed,
             sep="\t",
-            names=headers,
-        ).drop(columns=["Stop"])
-        return noncoding_probes_df
+            skiprows=header_lines,
+            usecols=[0, 1, 2, 3],
+            names=["Chr", "Start", "Stop", "Probe"],
+            dtype={"Chr": "category", "Start": "int32", "Stop": "int32", "Probe": str},
+        )
+        return probes_df
 
     def remove_probes(self) -> pd.DataFrame:
         """
         Generate the final list of probes by removing any probes that are within
         self.num_probes_distance of a coding region. For each group, remove
         self.num_probes number of probes with the lowest and self.num_probes number of
-        probes with the highest position, and write the remaining probes (probes to be
-        masked) to BED file
+        probes with the highest position. Probes are matched to their non-coding region
+        in memory, and the per-region filtering is run as a DuckDB query to give the
+        remaining probes (probes to be masked)
             :return probes_to_mask_df (pd.DataFrame):   Pandas dataframe containing
                                                         final probes that require
                                                         masking in the CHAS software
@@ -290,35 +305,39 @@ class GenerateBed():
             )
         return probes_to_mask_df
 
-    def remove_probes_within_regions(self, probes_within_regions) -> pd.DataFrame:
+    def remove_probes_within_regions(
+        self, probes_within_regions: duckdb.DuckDBPyRelation
+    ) -> duckdb.DuckDBPyRelation:
         """
         Remove all probes within regions of size < 2*self.num_probes, as all probes
         within these regions are < self.num_probes away from the nearest coding region
-            :param probes_within_regions (pd.DataFrame):    Pandas dataframe containing
+            :param probes_within_regions
+            (duckdb.DuckDBPyRelation):                      DuckDB relation containing
                                                             each probe mapped to the
                                                             region within which it falls
             :return filtered_probes_within_regions
-            (pd.DataFrame):                                 Pandas dataframe containing
+            (duckdb.DuckDBPyRelation):                      DuckDB relation containing
                                                             probes by region with
                                                             regions containing all
                                                             probes to be masked removed
         """
         min_region_size = 2*self.num_probes  # Set minimum region size
-        filtered_probes_within_regions = probes_within_regions.groupby(
-            ["range", "Chr"]
-        ).filter(
-            lambda x: len(x) >= min_region_size
+        filtered_probes_within_regions = probes_within_regions.filter(
+            f"region_size >= {min_region_size}"
         )
         return filtered_probes_within_regions
 
-    def remove_probes_by_distance(self, filtered_probes_within_regions) -> pd.DataFrame:
+    def remove_probes_by_distance(
+        self, filtered_probes_within_regions: duckdb.DuckDBPyRelation
+    ) -> pd.DataFrame:
         """
         Remove probes that are within self.num_probes of a coding region.
-        Use range (self.num_probes-1)-(self.num_probes-1) because index starts from 0
-        This retains only those probes greater than self.num_probes away from the
-        nearest coding region, i.e. those probes to be masked
+        Probes are numbered from 1, so keep probes numbered from self.num_probes to
+        (region size - (self.num_probes-1)). This retains only those probes greater
+        than self.num_probes away from the nearest coding region, i.e. those probes to
+        be masked. Output is sorted by chromosome and position
             :param filtered_probes_within_regions
-            (pd.DataFrame):                                 Pandas dataframe containing
+            (duckdb.DuckDBPyRelation):                      DuckDB relation containing
                                                             probes by region with
                                                             regions containing all
                                                             probes to be masked removed
@@ -326,48 +345,85 @@ class GenerateBed():
                                                             final probes that require
                                                             masking in the CHAS software
         """
-        probes_to_mask_df = filtered_probes_within_regions.groupby(
-            ["range", "Chr"], group_keys=False).apply(
-                lambda x: x.iloc[(self.num_probes-1):-(self.num_probes-1)]
-        ).reset_index()
-
-        probes_to_mask_df['Start'] = probes_to_mask_df['Pos']
-        probes_to_mask_df['Stop'] = probes_to_mask_df['Pos']
-        probes_to_mask_df.drop(["range", "Pos"], axis=1, inplace=True)
+        probes_to_mask_df = filtered_probes_within_regions.filter(
+            f"probe_number >= {self.num_probes} AND "
+            f"probe_number <= region_size - {self.num_probes - 1}"
+        ).project("Chr, Pos AS Start, Pos AS Stop, Probe").order("Start, Probe").df()
 
+        # Rows are already ordered by position, so a stable sort on the integer
+        # chromosome rank alone orders by chromosome and then position
+        chromosome_order = np.argsort(
+            natural_sort_key(probes_to_mask_df["Chr"]).to_numpy(), kind="stable"
+        )
+        probes_to_mask_df = probes_to_mask_df.iloc[chromosome_order].reset_index(
+            drop=True
+        )
         return probes_to_mask_df
 
-    def match_probes_to_regions(self) -> pd.DataFrame:
+    def match_probes_to_regions(self) -> duckdb.DuckDBPyRelation:
         """
-        Split all probes into 'per-region' groups for the noncoding regions in
-        self.noncoding_regions_df
-            :return probes_within_regions (pd.DataFrame):   Pandas dataframe containing
-                                                            each probe mapped to the
-                                                            region within which it falls
+        Split all probes within the noncoding regions into 'per-region' groups for the
+        noncoding regions in self.noncoding_regions, numbering the probes by position
+        within each region
+            :return probes_within_regions
+            (duckdb.DuckDBPyRelation):  DuckDB relation containing each probe mapped to
+                                        the region within which it falls, with its
+                                        number within the region and the region size
         """
-        noncoding_probes_df = self.noncoding_probes_df
-        noncoding_regions_df = self.noncoding_regions_df
-        # Join the noncoding probes to the noncoding regions which the probe falls
-        # within. Use of an SQL query is much faster / easier than using pandas
-        probes_within_regions = (
-            duckdb.query(
-                "SELECT * FROM noncoding_probes_df FULL OUTER JOIN noncoding_regions_df"
-                " ON noncoding_probes_df.Chr = noncoding_regions_df.Chr WHERE (Pos >= "
-                "Start AND Pos <= Stop)"
-            )
-            .df()
-            .set_index("Probe")
-        )  # Return a dataframe with Probe column as index
-        # Add a range column
-        probes_within_regions["range"] = (
-            probes_within_regions["Start"].astype(str) + "," +
-            probes_within_regions["Stop"].astype(str)
+        regions_df = self.noncoding_regions.df()
+        probes_df = self.probes_df
+        # Coordinates are int32 (the longest chromosome is < 2^31) apart from these
+        # keys. Encode chromosome and position as a single sortable int64 key, so the
+        # noncoding regions (which never overlap each other) can be binary searched
+        # for all probes at once rather than joining every probe to every region on
+        # the same chromosome
+        chromosomes = pd.Index(regions_df["Chr"].unique())
+        region_chr = chromosomes.get_indexer(regions_df["Chr"]).astype("int64") << 32
+        region_starts = region_chr | regions_df["Start"].to_numpy(dtype="int64")
+        region_stops = region_chr | regions_df["Stop"].to_numpy(dtype="int64")
+        region_order = np.argsort(region_starts, kind="stable")
+        region_starts = region_starts[region_order]
+        region_stops = region_stops[region_order]
+        # Look up each probe chromosome name once, then index by the categorical codes
+        probe_chr_codes = probes_df["Chr"].cat.codes.to_numpy()
+        probe_chr = chromosomes.get_indexer(
+            probes_df["Chr"].cat.categories
+        ).astype("int64")[probe_chr_codes]
+        on_region_chr = probe_chr >= 0  # Skip probes on chromosomes with no regions
+        probe_chr = probe_chr[on_region_chr] << 32
+        probe_start = probes_df["Start"].to_numpy(dtype="int32")[on_region_chr]
+        probe_stop = probes_df["Stop"].to_numpy(dtype="int32")[on_region_chr]
+        # The regions a probe overlaps run from the first region ending after the
+        # probe starts, up to the first region starting at or after the probe ends
+        first_region = np.searchsorted(
+            region_stops, probe_chr | probe_start, side="right"
         )
-        # Sort dataframe within each group by Pos column
-        probes_within_regions = (
-            probes_within_regions.groupby(["range", "Chr"])
-            .apply(lambda x: x.sort_values(by=["range", "Chr", "Pos"], ascending=True))
-            .drop(columns=["Start", "Stop", "Chr_2", "range", "Chr"])
+        last_region = np.searchsorted(region_starts, probe_chr | probe_stop, side="left")
+        num_regions = np.clip(last_region - first_region, 0, None)
+        # One row per overlapping probe and region
+        probe_index = np.repeat(np.arange(len(num_regions)), num_regions)
+        region_index = region_order[
+            first_region[probe_index] + np.arange(len(probe_index)) -
+            np.repeat(np.cumsum(num_regions) - num_regions, num_regions)
+        ]
+        region_start = regions_df["Start"].to_numpy(dtype="int32")[region_index]
+        matched_probes_df = pd.DataFrame({
+            "Chr": pd.Categorical.from_codes(
+                probe_chr_codes[on_region_chr][probe_index], dtype=probes_df["Chr"].dtype
+            ),
+            # Probe position is clipped to the start of the region, as for bedtools
+            # intersect
+            "Pos": np.maximum(probe_start[probe_index], region_start),
+            "Probe": probes_df["Probe"].to_numpy()[on_region_chr][probe_index],
+            "region_start": region_start,
+        })
+        # Register as a view, as the relation below is only evaluated in
+        # remove_probes_by_distance
+        duckdb.register("matched_probes_df", matched_probes_df)
+        probes_within_regions = duckdb.query(
+            "SELECT Chr, Pos, Probe, ROW_NUMBER() OVER (PARTITION BY Chr, region_start "
+            "ORDER BY Pos, Probe) AS probe_number, COUNT(*) OVER (PARTITION BY Chr, "
+            "region_start) AS region_size FROM matched_probes_df"
         )
         return probes_within_regions
 
@@ -376,20 +432,11 @@ class GenerateBed():
         Write to final csv, with header
             :return None:
         """
-        with open(self.probes_to_mask_bed, 'w', encoding="utf-8") as probes_bed:
+        with open(
+            self.probes_to_mask_bed, 'w', encoding="utf-8", newline=""
+        ) as probes_bed:
             probes_bed.write('track db="hg38"\n')
-        self.probes_to_mask_df.to_csv(
-            self.probes_to_mask_bed, sep="\t", header=None, index=False, mode='a',
-            columns=["Chr", "Start", "Stop", "Probe"],
-            )
-
-    def cleanup_intermediate_files(self) -> None:
-        """
-        Remove all intermediate BED files
-            :return None:
-        """
-        for file in [
-            self.coding_regions_bed, self.coding_regions_bed_sorted,
-            self.noncoding_regions_bed, self.noncoding_probes, self.grch38_genome_file
-        ]:
-            os.remove(file)
+            self.probes_to_mask_df.to_csv(
+                probes_bed, sep="\t", header=None, index=False,
+                columns=["Chr", "Start", "Stop", "Probe"],
+                )
@@ -3,17 +3,22 @@ This script has been written to export legacy Array data from moka
 """
 import os 
 import pandas as pd
-from ConfigParser import ConfigParser 
+try:
+    from configparser import ConfigParser # Python 3
+except ImportError:
+    from ConfigParser import ConfigParser # Python 2
 import pyodbc 
 
 # Read config file(must be called config.ini and stored in the same directory as script)
 config_parser = ConfigParser()
 print_config = config_parser.read(os.path.join(os.path.dirname(os.path.realpath(__file__)), "config.ini"))
+moka_server = config_parser.get("MOKA", "SERVER")
+moka_database = config_parser.get("MOKA", "DATABASE")
 
 # Create pyodbc connection to moka 
 cnxn = pyodbc.connect('DRIVER={{SQL Server}}; SERVER={server}; DATABASE={database};'.format(
-         server=config_parser.get("MOKA", "SERVER"),
-         database=config_parser.get("MOKA", "DATABASE")))
+         server=moka_server,
+         database=moka_database))
          
 
 '''=================================================== SCRIPT =================================================== ''' 
@@ -50,10 +55,13 @@ export_patient_data_SQL = ("SELECT DISTINCT 'chr' + [Chr] AS Chromo, ArrayOligoP
     "AND ((Arrays.DateRecieved) BETWEEN '2016-01-01 00:00:00' AND '2021-12-31 00:00:00') " # For current array plaform
     "AND ((ArrayTest.StatusID) = 4)" # Only tests which are completed 
     "AND ((Patients.BookinDOB)IS NOT NULL OR ([dbo].[gwv-patientlinked].[DoB]) IS NOT NULL))") # Only patients with a DOB in either Moka or GW
-# Run SQL query and store results in a pandas dataframe 
-export_patient_data_df = pd.read_sql(export_patient_data_SQL, cnxn)
-print("Data pulled from moka")
-
+# Run SQL query and save the results in chunks, so the whole result set is never held in memory at once.
 # Save as a tsv file, some characters are not ascii so encoding in utf-8
-export_patient_data_df.to_csv("moka_array_export_220215.tsv",sep = "\t", encoding='utf-8')
-print("Data saved")
+# The index column is kept (and numbered on from the previous chunk) as moka_array_legacy_data_export_tidy.R removes it
+rows_saved = 0
+for export_patient_data_df in pd.read_sql(export_patient_data_SQL, cnxn, chunksize=50000):
+    export_patient_data_df.index += rows_saved
+    export_patient_data_df.to_csv("moka_array_export_220215.tsv", sep = "\t", encoding='utf-8',
+                                  mode='w' if rows_saved == 0 else 'a', header=rows_saved == 0)
+    rows_saved += len(export_patient_data_df)
+print("Data pulled from moka and saved (%s rows)" % rows_saved)